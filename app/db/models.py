@@ -180,8 +180,9 @@ class Abastecimento(DeclarativeBase):
     """Registro de abastecimentos de estoque."""
     __tablename__ = "abastecimentos"
 
-    produto_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("produtos.id"), nullable=False, index=True)
-    usuario_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("usuarios.id"), nullable=True, index=True)
+    # Índices compostos (produto_id/usuario_id, created_at, id) criados na migração leve do startup
+    produto_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("produtos.id"), nullable=False)
+    usuario_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("usuarios.id"), nullable=True)
     quantidade: Mapped[float] = mapped_column(Float, nullable=False)
     custo_unitario: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
     # Campo exigido pela tabela (NOT NULL). Representa o total (quantidade * custo_unitario)
@@ -31,7 +31,8 @@ try:
         pool_timeout=30,              # Wait up to 30s for a connection
         echo=False,                   # Set to True for SQL debugging
         pool_size=5,                  # Tune according to Railway plan
-        max_overflow=5                # Allow short bursts
+        max_overflow=5,               # Allow short bursts
+        query_cache_size=1200         # Compiled SQL cache (default 500)
     )
     AsyncSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=engine)
 except Exception as e:
@@ -91,9 +91,29 @@ async def lifespan(app: FastAPI):
                 await conn.execute(text("ALTER TABLE abastecimentos ADD COLUMN IF NOT EXISTS custo_unitario DOUBLE PRECISION DEFAULT 0"))
                 await conn.execute(text("ALTER TABLE abastecimentos ADD COLUMN IF NOT EXISTS total_custo DOUBLE PRECISION DEFAULT 0"))
                 await conn.execute(text("ALTER TABLE abastecimentos ADD COLUMN IF NOT EXISTS observacao TEXT"))
-                await conn.execute(text("CREATE INDEX IF NOT EXISTS idx_abast_produto ON abastecimentos(produto_id)"))
-                await conn.execute(text("CREATE INDEX IF NOT EXISTS idx_abast_usuario ON abastecimentos(usuario_id)"))
-                await conn.execute(text("CREATE INDEX IF NOT EXISTS idx_abast_created ON abastecimentos(created_at)"))
+                # Índices compostos para o histórico: paginação por cursor (created_at, id)
+                # e filtros por produto/usuário já ordenados, sem sort em memória
+                # (NULLS LAST acompanha o ORDER BY do /historico)
+                await conn.execute(text("CREATE INDEX IF NOT EXISTS idx_abast_created_id ON abastecimentos(created_at DESC NULLS LAST, id DESC)"))
+                await conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS idx_abast_produto_created "
+                    "ON abastecimentos USING btree (produto_id, created_at DESC NULLS LAST, id DESC)"
+                ))
+                await conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS idx_abast_usuario_created "
+                    "ON abastecimentos USING btree (usuario_id, created_at DESC NULLS LAST, id DESC) "
+                    "WHERE usuario_id IS NOT NULL"
+                ))
+                # Índices simples cobertos pelos compostos acima (prefixo / parcial):
+                # removidos para não custarem escrita extra em cada INSERT
+                for old_idx in (
+                    "idx_abast_produto",
+                    "idx_abast_usuario",
+                    "idx_abast_created",
+                    "ix_abastecimentos_produto_id",
+                    "ix_abastecimentos_usuario_id",
+                ):
+                    await conn.execute(text(f"DROP INDEX IF EXISTS {old_idx}"))
                 await conn.execute(text("""
                     DO $$ BEGIN
                         IF NOT EXISTS (
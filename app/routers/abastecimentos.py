@@ -1,9 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, desc, asc
-from sqlalchemy.orm import selectinload
-from typing import Optional, List
-from datetime import datetime
+from sqlalchemy import select, update, and_, or_, desc, asc, tuple_, values, column, cast, bindparam, func, Integer, Float, DateTime
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID, insert as pg_insert
+from typing import Optional, List, Tuple, Dict, Set, DefaultDict
+from collections import defaultdict
+from datetime import datetime, date, time, timedelta, timezone
+import base64
 import uuid
 
 from app.db.database import get_db_session
@@ -11,14 +15,162 @@ from app.db.models import Abastecimento, Produto, User
 
 router = APIRouter(prefix="/api/abastecimentos", tags=["Abastecimentos"]) 
 
-@router.get("/historico")
+
+class AbastecimentoIn(BaseModel):
+    local_id: Optional[str] = Field(None, description="Identificador local opcional para correlacionar resposta")
+    produto_id: Optional[str] = Field(None, description="UUID do produto")
+    produto_codigo: Optional[str] = Field(None, description="Código único do produto")
+    usuario_id: Optional[str] = Field(None, description="UUID do usuário")
+    quantidade: float
+    custo_unitario: float
+    total_custo: Optional[float] = None
+    observacao: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+    # O PDV3 envia campos extras; "ignore" (padrão do Pydantic v2) fica explícito
+    model_config = ConfigDict(extra="ignore")
+
+
+class AbastecimentoBulkIn(BaseModel):
+    items: List[AbastecimentoIn]
+
+    model_config = ConfigDict(extra="ignore")
+
+
+_UUID = uuid.UUID
+_fromiso = datetime.fromisoformat
+_date_fromiso = date.fromisoformat
+
+
+# Linhas por statement em lote (VALUES/IN): mantém os parâmetros bem abaixo do
+# limite de 32767 por statement do protocolo do Postgres.
+_SQL_CHUNK = 1000
+
+
+def _chunks(seq: list, size: int):
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
+# Statements de forma fixa do /bulk, construídos uma vez no import; a compilação
+# para SQL fica no cache do engine (query_cache_size) e é reaproveitada a cada lote.
+_PRODUTOS_LOTE_STMT = select(Produto.id, Produto.codigo).where(
+    or_(
+        Produto.id.in_(bindparam("pids", expanding=True)),
+        Produto.codigo.in_(bindparam("codes", expanding=True)),
+    )
+)
+# render_nulls: sem isso o ORM omite chaves None (usuario_id/observacao) e quebra o
+# executemany em vários INSERTs, um por sequência de linhas com o mesmo conjunto de colunas.
+_INSERT_ABAST_STMT = pg_insert(Abastecimento).execution_options(render_nulls=True)
+
+
+def _parse_uuid(value: Optional[str]) -> Optional[uuid.UUID]:
+    """Converte para UUID, devolvendo None para vazio ou inválido."""
+    if not value:
+        return None
+    try:
+        return _UUID(value)
+    except ValueError:
+        return None
+
+
+def _encode_cursor(created_at: datetime, abast_id: uuid.UUID) -> str:
+    raw = f"{created_at.isoformat()}|{abast_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    ts, abast_id = raw.split("|", 1)
+    return _fromiso(ts), _UUID(abast_id)
+
+
+def _data_inicial_condition(data_inicial: str):
+    try:
+        di = datetime.combine(_date_fromiso(data_inicial), time.min)
+    except ValueError:
+        di = _fromiso(data_inicial)
+    return Abastecimento.created_at >= di
+
+
+def _data_final_condition(data_final: str):
+    # YYYY-MM-DD inclui o dia inteiro: created_at < dia seguinte 00:00
+    try:
+        df = _date_fromiso(data_final)
+    except ValueError:
+        return Abastecimento.created_at <= _fromiso(data_final)
+    return Abastecimento.created_at < datetime.combine(df + timedelta(days=1), time.min)
+
+
+def _keyset_condition(c_ts: datetime, c_id: uuid.UUID, ordenacao: str):
+    keyset = tuple_(Abastecimento.created_at, Abastecimento.id)
+    last_seen = tuple_(c_ts, c_id, types=[Abastecimento.created_at.type, Abastecimento.id.type])
+    # created_at é anulável: linhas sem data ficam no fim da ordenação (NULLS LAST)
+    # e fora da paginação por cursor, que não tem como apontar para elas
+    not_null = Abastecimento.created_at.is_not(None)
+    if ordenacao == "created_at_asc":
+        return and_(not_null, keyset > last_seen)
+    return and_(not_null, keyset < last_seen)
+
+
+def _partition_batch(
+    indices: List[int],
+    dup_keys: Dict[int, tuple],
+    dup_idx: Set[int],
+) -> Tuple[List[int], List[int], List[Tuple[int, int]]]:
+    """Separa os itens do /bulk em novos, já existentes e repetições no lote.
+
+    Devolve (novos, existentes, repeticoes): os índices a inserir, na ordem do
+    INSERT; os índices cuja chave já existe no banco (aceitos sem inserir); e
+    pares (idx, posição em novos da primeira ocorrência) para itens repetidos
+    dentro do lote, que só podem ser aceitos se essa primeira ocorrência entrar.
+    """
+    new: List[int] = []
+    existing: List[int] = []
+    repeats: List[Tuple[int, int]] = []
+    first_of_key: dict = {}
+    insert_pos: dict = {}
+    for idx in indices:
+        key = dup_keys.get(idx)
+        first = first_of_key.get(key) if key is not None else None
+        if key is not None and first is None:
+            first_of_key[key] = idx
+        if idx in dup_idx or (first is not None and first in dup_idx):
+            existing.append(idx)
+        elif first is not None:
+            repeats.append((idx, insert_pos[first]))
+        else:
+            insert_pos[idx] = len(new)
+            new.append(idx)
+    return new, existing, repeats
+
+
+def _settle_repeats(repeats: List[Tuple[int, int]], ok_pos: Set[int]) -> Tuple[List[int], List[int]]:
+    """Divide as repetições entre aceitas e falhas conforme a primeira ocorrência foi gravada."""
+    accepted = [idx for idx, pos in repeats if pos in ok_pos]
+    failed = [idx for idx, pos in repeats if pos not in ok_pos]
+    return accepted, failed
+
+
+def _stock_deltas(rows: List[dict], ok_pos: Set[int]) -> DefaultDict[uuid.UUID, float]:
+    """Soma a quantidade por produto apenas das linhas efetivamente inseridas."""
+    deltas: DefaultDict[uuid.UUID, float] = defaultdict(float)
+    for pos in ok_pos:
+        deltas[rows[pos]["produto_id"]] += rows[pos]["quantidade"]
+    return deltas
+
+
+@router.get("/historico", response_class=ORJSONResponse)
 async def get_historico_abastecimentos(
     data_inicial: Optional[str] = Query(None, description="YYYY-MM-DD"),
     data_final: Optional[str] = Query(None, description="YYYY-MM-DD"),
     usuario_id: Optional[str] = Query(None),
     produto_id: Optional[str] = Query(None),
     pagina: int = Query(1, ge=1),
+    cursor: Optional[str] = Query(None, description="Cursor opaco devolvido em next_cursor (tem prioridade sobre pagina)"),
     limite: int = Query(50, ge=1, le=200),
+    peek_next: bool = Query(True, description="False: busca exatamente `limite` linhas e não calcula has_next/next_cursor"),
     ordenacao: str = Query("created_at_desc", pattern="^(created_at_desc|created_at_asc)$"),
     db: AsyncSession = Depends(get_db_session),
 ):
@@ -26,103 +178,123 @@ async def get_historico_abastecimentos(
         conditions = []
 
         # Intervalo de datas
+        # YYYY-MM-DD vira intervalo semiaberto [di 00:00, df + 1 dia), que usa o
+        # índice de created_at como range scan; data com hora mantém o valor exato.
         if data_inicial:
             try:
-                di = datetime.fromisoformat(data_inicial)
-                conditions.append(Abastecimento.created_at >= di)
+                conditions.append(_data_inicial_condition(data_inicial))
             except ValueError:
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="data_inicial inválida")
         if data_final:
             try:
-                # incluir o dia inteiro
-                df = datetime.fromisoformat(data_final)
-                conditions.append(Abastecimento.created_at <= df)
+                conditions.append(_data_final_condition(data_final))
             except ValueError:
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="data_final inválida")
 
         # Filtros opcionais por IDs
         if produto_id:
-            try:
-                pid = uuid.UUID(produto_id)
-                conditions.append(Abastecimento.produto_id == pid)
-            except ValueError:
+            pid = _parse_uuid(produto_id)
+            if pid is None:
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="produto_id inválido")
+            conditions.append(Abastecimento.produto_id == pid)
         if usuario_id:
-            try:
-                uid = uuid.UUID(usuario_id)
-                conditions.append(Abastecimento.usuario_id == uid)
-            except ValueError:
+            uid = _parse_uuid(usuario_id)
+            if uid is None:
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="usuario_id inválido")
+            conditions.append(Abastecimento.usuario_id == uid)
 
-        # Base query
+        # Base query: um único SELECT com JOIN trazendo só as colunas usadas na resposta
         query = (
-            select(Abastecimento)
-            .options(
-                selectinload(Abastecimento.produto),
-                selectinload(Abastecimento.usuario),
+            select(
+                Abastecimento.id,
+                Abastecimento.produto_id,
+                Abastecimento.quantidade,
+                Abastecimento.custo_unitario,
+                Abastecimento.total_custo,
+                Abastecimento.usuario_id,
+                Abastecimento.created_at,
+                Abastecimento.observacao,
+                Produto.nome.label("produto_nome"),
+                Produto.codigo.label("codigo"),
+                User.nome.label("usuario_nome"),
             )
+            .outerjoin(Produto, Produto.id == Abastecimento.produto_id)
+            .outerjoin(User, User.id == Abastecimento.usuario_id)
         )
+        # Paginação por cursor (keyset): (created_at, id) do último item visto.
+        # Evita o custo linear do OFFSET em páginas profundas.
+        if cursor:
+            try:
+                c_ts, c_id = _decode_cursor(cursor)
+            except Exception:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="cursor inválido")
+            conditions.append(_keyset_condition(c_ts, c_id, ordenacao))
+
         if conditions:
             query = query.where(and_(*conditions))
 
-        # Ordenação
+        # Ordenação (id como desempate para o cursor ser estável)
         if ordenacao == "created_at_asc":
-            query = query.order_by(asc(Abastecimento.created_at))
+            query = query.order_by(asc(Abastecimento.created_at).nulls_last(), asc(Abastecimento.id))
         else:
-            query = query.order_by(desc(Abastecimento.created_at))
+            query = query.order_by(desc(Abastecimento.created_at).nulls_last(), desc(Abastecimento.id))
 
         # Paginação
-        offset = (pagina - 1) * limite
-        result = await db.execute(query.offset(offset).limit(limite + 1))
-        rows: List[Abastecimento] = result.scalars().all()
-        has_next = len(rows) > limite
-        items = rows[:limite]
+        if not cursor:
+            # Compatibilidade: clientes antigos ainda paginam por número de página
+            query = query.offset((pagina - 1) * limite)
 
-        def serialize(a: Abastecimento):
+        # UUID/datetime/float saem direto pelo orjson (mesmo formato de str()/isoformat())
+        def serialize(r):
             return {
-                "id": str(a.id),
-                "produto_id": str(a.produto_id),
-                "produto_nome": getattr(a.produto, "nome", None),
-                "codigo": getattr(a.produto, "codigo", None),
-                "quantidade": float(a.quantidade or 0),
-                "custo_unitario": float(a.custo_unitario or 0),
-                "total_custo": float(a.total_custo or 0),
-                "usuario_id": str(a.usuario_id) if a.usuario_id else None,
-                "usuario_nome": getattr(a.usuario, "nome", None) if a.usuario else None,
-                "created_at": a.created_at.isoformat() if a.created_at else None,
-                "observacao": a.observacao,
+                "id": r.id,
+                "produto_id": r.produto_id,
+                "produto_nome": r.produto_nome,
+                "codigo": r.codigo,
+                "quantidade": r.quantidade or 0.0,
+                "custo_unitario": r.custo_unitario or 0.0,
+                "total_custo": r.total_custo or 0.0,
+                "usuario_id": r.usuario_id,
+                "usuario_nome": r.usuario_nome,
+                "created_at": r.created_at,
+                "observacao": r.observacao,
             }
 
-        payload = [serialize(a) for a in items]
+        # Serializa direto do stream, sem listas intermediárias; a linha extra
+        # (limite + 1) só indica se existe próxima página e é dispensada com peek_next=False.
+        n = limite + 1 if peek_next else limite
+        payload = []
+        has_next = False
+        last = None
+        stream = await db.stream(query.limit(n).execution_options(yield_per=n))
+        try:
+            async for r in stream:
+                if len(payload) == limite:
+                    has_next = True
+                    break
+                payload.append(serialize(r))
+                last = r
+        finally:
+            await stream.close()
 
-        return {
+        next_cursor = None
+        if has_next and last is not None and last.created_at is not None:
+            next_cursor = _encode_cursor(last.created_at, last.id)
+
+        # Resposta já montada: evita o jsonable_encoder do FastAPI sobre cada item
+        return ORJSONResponse({
             "items": payload,
-            "pagina": pagina,
+            # Com cursor a página não é usada
+            "pagina": None if cursor else pagina,
             "limite": limite,
             "has_next": has_next,
-        }
+            "next_cursor": next_cursor,
+        })
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Erro ao buscar histórico: {e}")
 
-from pydantic import BaseModel, Field
-from typing import Optional as Opt
-
-class AbastecimentoIn(BaseModel):
-    local_id: Opt[str] = Field(None, description="Identificador local opcional para correlacionar resposta")
-    produto_id: Opt[str] = Field(None, description="UUID do produto")
-    produto_codigo: Opt[str] = Field(None, description="Código único do produto")
-    usuario_id: Opt[str] = Field(None, description="UUID do usuário")
-    quantidade: float
-    custo_unitario: float
-    total_custo: Opt[float] = None
-    observacao: Opt[str] = None
-    created_at: Opt[datetime] = None
-
-class AbastecimentoBulkIn(BaseModel):
-    items: List[AbastecimentoIn]
-
 @router.post("/bulk")
 async def bulk_create_abastecimentos(payload: AbastecimentoBulkIn, db: AsyncSession = Depends(get_db_session)):
     try:
@@ -130,118 +302,212 @@ async def bulk_create_abastecimentos(payload: AbastecimentoBulkIn, db: AsyncSess
         conflicts: List[dict] = []
         accepted: List[str] = []
 
-        for item in payload.items:
+        # UUIDs de cada item convertidos uma única vez (inválidos viram None)
+        items = payload.items
+        item_pids = [_parse_uuid(item.produto_id) for item in items]
+        item_uids = [_parse_uuid(item.usuario_id) for item in items]
+
+        # Resolver todos os produtos do lote numa única consulta (evita N+1)
+        pids = {pid for pid in item_pids if pid is not None}
+        codes = {item.produto_codigo for item in items if item.produto_codigo}
+
+        # Só id/codigo: tuplas direto do driver, sem hidratar entidades Produto
+        found_ids = set()
+        by_code: dict = {}
+        # Em blocos de _SQL_CHUNK: cada elemento do IN é um parâmetro do statement
+        lookups = [{"pids": chunk, "codes": []} for chunk in _chunks(list(pids), _SQL_CHUNK)]
+        lookups += [{"pids": [], "codes": chunk} for chunk in _chunks(list(codes), _SQL_CHUNK)]
+        for params in lookups:
+            res = await db.execute(_PRODUTOS_LOTE_STMT, params)
+            for prod_id, codigo in res.all():
+                found_ids.add(prod_id)
+                if codigo:
+                    by_code[codigo] = prod_id
+
+        # created_at vai direto no INSERT; sem valor do PDV usa o instante do pedido
+        agora = datetime.now(timezone.utc)
+
+        # 1ª passagem: resolver produto/usuário e montar a linha de cada item.
+        # Os totais são calculados uma vez aqui e reaproveitados na dedupe e no INSERT
+        # (quantidade/custo_unitario já chegam como float pelo Pydantic).
+        resolved: List[Tuple[AbastecimentoIn, dict]] = []
+        for item, pid, usuario_uuid in zip(items, item_pids, item_uids):
+            # Resolver produto por ID ou código
+            prod_id = pid if pid in found_ids else None
+            if prod_id is None and item.produto_codigo:
+                prod_id = by_code.get(item.produto_codigo)
+
+            if prod_id is None:
+                conflicts.append({
+                    "reason": "produto_nao_encontrado",
+                    "produto_id": item.produto_id,
+                    "produto_codigo": item.produto_codigo,
+                })
+                continue
+
+            qtd = item.quantidade
+            custo_unitario = item.custo_unitario
+            total_val = qtd * custo_unitario
+            total_custo = item.total_custo if item.total_custo is not None else total_val
+
+            resolved.append((item, {
+                "produto_id": prod_id,
+                "usuario_id": usuario_uuid,
+                "quantidade": qtd,
+                "custo_unitario": custo_unitario,
+                "total": total_val,
+                "total_custo": total_custo,
+                "observacao": item.observacao,
+                "created_at": item.created_at or agora,
+            }))
+
+        # Deduplicação defensiva:
+        # O PDV3 envia "local_id" do SQLite local (não é globalmente único), então
+        # não dá para impor unicidade global só por local_id. Porém, para evitar
+        # somar estoque duas vezes quando o mesmo item é reenviado, usamos uma
+        # chave determinística quando `created_at` vier preenchido.
+        #
+        # Critério (quando created_at existe):
+        # (produto_id, usuario_id, quantidade, custo_unitario, total_custo, created_at)
+        #
+        # Se já existir um registro igual, consideramos idempotente: aceitamos
+        # o local_id e não inserimos nada (nem mexemos no estoque).
+        # Todas as chaves do lote são verificadas numa única consulta (VALUES + JOIN).
+        dup_keys: dict = {}
+        for idx, (item, row) in enumerate(resolved):
+            if item.created_at:
+                dup_keys[idx] = (
+                    row["produto_id"],
+                    row["usuario_id"],
+                    row["quantidade"],
+                    row["custo_unitario"],
+                    row["total_custo"],
+                    item.created_at,
+                )
+
+        # Em blocos de _SQL_CHUNK linhas: cada linha do VALUES usa 7 parâmetros e o
+        # protocolo do Postgres aceita no máximo 32767 por statement.
+        dup_idx = set()
+        dedup_failed = set()
+        if dup_keys:
             try:
-                # Resolver produto por ID ou código
-                produto_obj = None
-                if item.produto_id:
-                    try:
-                        pid = uuid.UUID(item.produto_id)
-                        res = await db.execute(select(Produto).where(Produto.id == pid))
-                        produto_obj = res.scalar_one_or_none()
-                    except ValueError:
-                        pass
-                if not produto_obj and item.produto_codigo:
-                    res = await db.execute(select(Produto).where(Produto.codigo == item.produto_codigo))
-                    produto_obj = res.scalar_one_or_none()
-
-                if not produto_obj:
+                # SAVEPOINT: uma falha aqui não deixa a transação externa abortada
+                async with db.begin_nested():
+                    for chunk in _chunks(list(dup_keys.items()), _SQL_CHUNK):
+                        v = values(
+                            column("idx", Integer),
+                            column("produto_id", PG_UUID(as_uuid=True)),
+                            column("usuario_id", PG_UUID(as_uuid=True)),
+                            column("quantidade", Float),
+                            column("custo_unitario", Float),
+                            column("total_custo", Float),
+                            column("created_at", DateTime(timezone=True)),
+                            name="v",
+                        ).data([(idx,) + key for idx, key in chunk])
+                        dup_q = (
+                            select(v.c.idx)
+                            .select_from(v)
+                            .join(
+                                Abastecimento,
+                                and_(
+                                    Abastecimento.produto_id == v.c.produto_id,
+                                    # NULL literal no VALUES não carrega tipo; cast explícito para uuid
+                                    Abastecimento.usuario_id.is_not_distinct_from(cast(v.c.usuario_id, PG_UUID(as_uuid=True))),
+                                    Abastecimento.quantidade == v.c.quantidade,
+                                    Abastecimento.custo_unitario == v.c.custo_unitario,
+                                    Abastecimento.total_custo == v.c.total_custo,
+                                    Abastecimento.created_at == v.c.created_at,
+                                ),
+                            )
+                            .distinct()
+                        )
+                        dup_res = await db.execute(dup_q)
+                        dup_idx.update(dup_res.scalars().all())
+            except Exception as de:
+                # Sem dedupe não dá para saber se o item já entrou: inserir poderia somar o
+                # estoque duas vezes num reenvio. Devolve como conflito para o PDV3 reenviar.
+                dup_idx = set()
+                dedup_failed = set(dup_keys)
+                for idx in dup_keys:
                     conflicts.append({
-                        "reason": "produto_nao_encontrado",
-                        "produto_id": item.produto_id,
-                        "produto_codigo": item.produto_codigo,
+                        "reason": "erro_dedupe",
+                        "message": str(de),
+                        "local_id": resolved[idx][0].local_id,
                     })
-                    continue
+                dup_keys = {}
 
-                usuario_uuid = None
-                if item.usuario_id:
-                    try:
-                        usuario_uuid = uuid.UUID(item.usuario_id)
-                    except ValueError:
-                        usuario_uuid = None
-
-                # Deduplicação defensiva:
-                # O PDV3 envia "local_id" do SQLite local (não é globalmente único), então
-                # não dá para impor unicidade global só por local_id. Porém, para evitar
-                # somar estoque duas vezes quando o mesmo item é reenviado, usamos uma
-                # chave determinística quando `created_at` vier preenchido.
-                #
-                # Critério (quando created_at existe):
-                # (produto_id, usuario_id, quantidade, custo_unitario, total_custo, created_at)
-                #
-                # Se já existir um registro igual, consideramos idempotente: aceitamos
-                # o local_id e não inserimos nada (nem mexemos no estoque).
-                if item.created_at:
+        # 2ª passagem: separar as linhas novas, as que já existem no banco e as
+        # repetições dentro do lote
+        new_idx, existing_idx, repeats = _partition_batch(
+            [idx for idx in range(len(resolved)) if idx not in dedup_failed],
+            dup_keys,
+            dup_idx,
+        )
+        for idx in existing_idx:
+            # Já existe no banco: idempotente
+            local_id = resolved[idx][0].local_id
+            if local_id is not None:
+                accepted.append(str(local_id))
+
+        insert_rows: List[dict] = [resolved[idx][1] for idx in new_idx]
+        insert_local_ids: List[Optional[str]] = [resolved[idx][0].local_id for idx in new_idx]
+
+        if insert_rows:
+            ok_idx: List[int] = []
+            try:
+                # Um único INSERT em lote (executemany) dentro de um SAVEPOINT: se falhar
+                # (ex.: corrida com outro envio), só o lote é desfeito e a transação segue.
+                # executemany grava todas as linhas ou falha por inteiro.
+                async with db.begin_nested():
+                    await db.execute(_INSERT_ABAST_STMT, insert_rows)
+                ok_idx = list(range(len(insert_rows)))
+            except Exception:
+                # Refaz item a item, cada um no seu SAVEPOINT, para isolar o que falhou
+                ok_idx = []
+                for i, row in enumerate(insert_rows):
                     try:
-                        qtd_f = float(item.quantidade)
-                        cu_f = float(item.custo_unitario)
-                        tc_f = float(item.total_custo) if item.total_custo is not None else (qtd_f * cu_f)
-                        dup_q = (
-                            select(Abastecimento.id)
-                            .where(Abastecimento.produto_id == produto_obj.id)
-                            .where(Abastecimento.quantidade == qtd_f)
-                            .where(Abastecimento.custo_unitario == cu_f)
-                            .where(Abastecimento.total_custo == tc_f)
-                            .where(Abastecimento.created_at == item.created_at)
-                        )
-                        if usuario_uuid is None:
-                            dup_q = dup_q.where(Abastecimento.usuario_id.is_(None))
-                        else:
-                            dup_q = dup_q.where(Abastecimento.usuario_id == usuario_uuid)
-
-                        dup_res = await db.execute(dup_q.limit(1))
-                        dup_id = dup_res.scalar_one_or_none()
-                        if dup_id is not None:
-                            if item.local_id is not None:
-                                accepted.append(str(item.local_id))
-                            continue
-                    except Exception:
-                        # Se a dedupe falhar, segue fluxo normal.
-                        pass
-
-                total_custo = item.total_custo if item.total_custo is not None else (float(item.quantidade) * float(item.custo_unitario))
-                total_val = float(item.quantidade) * float(item.custo_unitario)
-
-                abast = Abastecimento(
-                    produto_id=produto_obj.id,
-                    usuario_id=usuario_uuid,
-                    quantidade=float(item.quantidade),
-                    custo_unitario=float(item.custo_unitario),
-                    total=float(total_val),
-                    total_custo=float(total_custo),
-                    observacao=item.observacao,
+                        async with db.begin_nested():
+                            await db.execute(_INSERT_ABAST_STMT, [row])
+                        ok_idx.append(i)
+                    except Exception as ie:
+                        conflicts.append({"reason": "erro_interno", "message": str(ie), "local_id": insert_local_ids[i]})
+
+            ok_pos = set(ok_idx)
+            repeat_ok, repeat_failed = _settle_repeats(repeats, ok_pos)
+            for idx in repeat_ok:
+                local_id = resolved[idx][0].local_id
+                if local_id is not None:
+                    accepted.append(str(local_id))
+            for idx in repeat_failed:
+                conflicts.append({
+                    "reason": "erro_interno",
+                    "message": "primeira ocorrência do item no lote não foi gravada",
+                    "local_id": resolved[idx][0].local_id,
+                })
+
+            # Atualizar estoque do produto (entrada de mercadoria) só com o que entrou
+            deltas = _stock_deltas(insert_rows, ok_pos)
+
+            # Estoque: um único UPDATE ... FROM (VALUES ...) com o delta somado por produto,
+            # então vários abastecimentos do mesmo produto geram uma só escrita.
+            # updated_at também avança para que clientes (PDV3) detectem a mudança via pull
+            # e reflitam o novo estoque localmente.
+            changed = [(prod_id, delta) for prod_id, delta in deltas.items() if delta]
+            for chunk in _chunks(changed, _SQL_CHUNK):
+                sub = values(
+                    column("id", PG_UUID(as_uuid=True)),
+                    column("delta", Float),
+                    name="sub",
+                ).data(chunk)
+                await db.execute(
+                    update(Produto)
+                    .where(Produto.id == sub.c.id)
+                    .values(estoque=func.coalesce(Produto.estoque, 0) + sub.c.delta, updated_at=func.now())
+                    .execution_options(synchronize_session=False)
                 )
 
-                # Atualizar estoque do produto (entrada de mercadoria)
-                try:
-                    qtd = float(item.quantidade)
-                except Exception:
-                    qtd = 0.0
-                produto_obj.estoque = float(getattr(produto_obj, "estoque", 0) or 0) + qtd
-
-                # Forçar atualização do updated_at do produto para que clientes (PDV3)
-                # detectem a mudança via pull e reflitam o novo estoque localmente.
-                try:
-                    setattr(produto_obj, 'updated_at', datetime.utcnow())
-                except Exception:
-                    pass
-
-                db.add(abast)
-                await db.flush()
-
-                # Ajuste de created_at se informado
-                if item.created_at:
-                    await db.execute(
-                        Abastecimento.__table__.update()
-                        .where(Abastecimento.id == abast.id)
-                        .values(created_at=item.created_at)
-                    )
-
-                inserted += 1
-                if item.local_id is not None:
-                    accepted.append(str(item.local_id))
-            except Exception as ie:
-                conflicts.append({"reason": "erro_interno", "message": str(ie), "local_id": item.local_id})
+            inserted = len(ok_idx)
+            accepted.extend(str(insert_local_ids[i]) for i in ok_idx if insert_local_ids[i] is not None)
 
         if inserted:
             await db.commit()
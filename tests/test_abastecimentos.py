@@ -0,0 +1,133 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy.dialects.postgresql import asyncpg
+
+from app.routers.abastecimentos import (
+    _data_final_condition,
+    _data_inicial_condition,
+    _decode_cursor,
+    _encode_cursor,
+    _keyset_condition,
+    _partition_batch,
+    _settle_repeats,
+    _stock_deltas,
+)
+
+
+def _compile(condition):
+    return condition.compile(dialect=asyncpg.dialect())
+
+
+def test_cursor_round_trip():
+    ts = datetime(2024, 3, 5, 14, 30, 15, 123456, tzinfo=timezone(timedelta(hours=2)))
+    abast_id = uuid.uuid4()
+
+    assert _decode_cursor(_encode_cursor(ts, abast_id)) == (ts, abast_id)
+
+
+def test_cursor_invalido():
+    with pytest.raises(ValueError):
+        _decode_cursor(_encode_cursor(datetime(2024, 1, 1), uuid.uuid4())[:-8] + "xx")
+
+
+@pytest.mark.parametrize(
+    "ordenacao, operador",
+    [("created_at_desc", "<"), ("created_at_asc", ">")],
+)
+def test_keyset_condition(ordenacao, operador):
+    ts = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    abast_id = uuid.uuid4()
+
+    compiled = _compile(_keyset_condition(ts, abast_id, ordenacao))
+
+    sql = str(compiled)
+    assert f"(abastecimentos.created_at, abastecimentos.id) {operador} (" in sql
+    assert "abastecimentos.created_at IS NOT NULL" in sql
+    assert "TIMESTAMP WITH TIME ZONE" in sql
+    assert sorted(compiled.params.values(), key=str) == sorted([ts, abast_id], key=str)
+
+
+def test_data_final_inclui_o_dia_inteiro():
+    compiled = _compile(_data_final_condition("2024-01-31"))
+
+    assert "abastecimentos.created_at <" in str(compiled)
+    assert "<=" not in str(compiled)
+    assert list(compiled.params.values()) == [datetime(2024, 2, 1)]
+
+
+def test_data_final_com_hora_mantem_valor_exato():
+    compiled = _compile(_data_final_condition("2024-01-31T12:00:00"))
+
+    assert "abastecimentos.created_at <=" in str(compiled)
+    assert list(compiled.params.values()) == [datetime(2024, 1, 31, 12)]
+
+
+def test_data_inicial_comeca_a_meia_noite():
+    compiled = _compile(_data_inicial_condition("2024-01-01"))
+
+    assert "abastecimentos.created_at >=" in str(compiled)
+    assert list(compiled.params.values()) == [datetime(2024, 1, 1)]
+
+
+def test_data_invalida():
+    with pytest.raises(ValueError):
+        _data_final_condition("31/01/2024")
+
+
+KEY_A = ("produto-a", None, 1.0, 2.0, 2.0, "2024-01-01T00:00:00")
+KEY_B = ("produto-b", None, 1.0, 2.0, 2.0, "2024-01-01T00:00:00")
+
+
+def test_partition_itens_sem_chave_sao_novos():
+    new, existing, repeats = _partition_batch([0, 1, 2], {}, set())
+
+    assert (new, existing, repeats) == ([0, 1, 2], [], [])
+
+
+def test_partition_duplicado_no_banco_e_aceito_sem_inserir():
+    new, existing, repeats = _partition_batch([0, 1], {0: KEY_A, 1: KEY_B}, {1})
+
+    assert (new, existing, repeats) == ([0], [1], [])
+
+
+def test_partition_repeticao_de_duplicado_no_banco_tambem_existe():
+    new, existing, repeats = _partition_batch([0, 1, 2], {0: KEY_A, 2: KEY_A}, {0})
+
+    assert (new, existing, repeats) == ([1], [0, 2], [])
+
+
+def test_partition_repeticao_aponta_para_posicao_da_primeira_ocorrencia():
+    new, existing, repeats = _partition_batch([0, 1, 2, 3], {1: KEY_A, 3: KEY_A}, set())
+
+    assert new == [0, 1, 2]
+    assert existing == []
+    # a primeira ocorrência (idx 1) é a posição 1 do INSERT
+    assert repeats == [(3, 1)]
+
+
+def test_partition_respeita_indices_excluidos():
+    new, existing, repeats = _partition_batch([0, 2], {0: KEY_A, 1: KEY_A, 2: KEY_A}, set())
+
+    assert (new, existing, repeats) == ([0], [], [(2, 0)])
+
+
+def test_settle_repeats_so_aceita_se_primeira_ocorrencia_foi_gravada():
+    accepted, failed = _settle_repeats([(3, 0), (4, 1)], ok_pos={0})
+
+    assert accepted == [3]
+    assert failed == [4]
+
+
+def test_stock_deltas_soma_so_linhas_gravadas():
+    pa, pb = uuid.uuid4(), uuid.uuid4()
+    rows = [
+        {"produto_id": pa, "quantidade": 2.0},
+        {"produto_id": pa, "quantidade": 3.0},
+        {"produto_id": pb, "quantidade": 5.0},
+    ]
+
+    deltas = _stock_deltas(rows, ok_pos={0, 1})
+
+    assert dict(deltas) == {pa: 5.0}